@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 
 import argparse
+from collections import OrderedDict
 from functools import reduce
+from multiprocessing import Pool
 
 def cal_hash(data, hash_fun, times=1):
     """Calculate the hash value for the input"""
@@ -18,6 +20,30 @@ def cal_hash(data, hash_fun, times=1):
     return hash_fun(hash_list)
 
 
+def cal_hash_rotated(data, hash_fun, times=1):
+    """Calculate the hash value with the list kept rotated
+
+    The list is a bytearray rotated so the current position is always at
+    index 0, a reversal is then a plain slice reversal and moving forward
+    is a rotation. The total rotation is undone once at the end.
+    """
+    size = 256
+    state = bytearray(range(size))
+    offset = 0
+    skip = 0
+
+    for _ in range(times):
+        for length in data:
+            if length > size:
+                raise ValueError('length %s is longer than the list' % length)
+            state[:length] = state[length - 1::-1] if length else b''
+            step = (length + skip) % size
+            state[:] = state[step:] + state[:step]
+            offset = (offset + step) % size
+            skip += 1
+
+    return hash_fun(state[size - offset:] + state[:size - offset])
+
 def reverse(hlist, index, length):
     """Reverse the elements between index and index + length"""
     list_len = len(hlist)
@@ -46,6 +72,81 @@ def hex_hash_fun(hash_list):
 
     return ''.join(hex_values)
 
+def hex_hash_bytes(hash_list):
+    """Generate the same hash as hex_hash_fun, folding each block of 16
+    numbers as one 128 bit int"""
+    blocks = bytes(hash_list)
+    dense = bytearray(16)
+    for i in range(16):
+        value = int.from_bytes(blocks[i * 16:i * 16 + 16], 'big')
+        value ^= value >> 64
+        value ^= value >> 32
+        value ^= value >> 16
+        value ^= value >> 8
+        dense[i] = value & 0xff
+
+    return dense.hex()
+
+HASH_SUFFIX = [17, 31, 73, 47, 23]
+
+def knot_hash(key):
+    """Dense hex hash of key (bytes)"""
+    return cal_hash_rotated(list(key) + HASH_SUFFIX, hex_hash_bytes, 64)
+
+class HashCache:
+    """Least recently used dense hashes, keyed on the input bytes"""
+    def __init__(self, maxsize=1 << 16):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+HASH_CACHE = HashCache()
+
+def knot_hashes(keys, workers=None, chunksize=16, cache=HASH_CACHE):
+    """Dense hex hashes of an iterable of byte strings, in order
+
+    Cached keys are answered from cache, every other distinct key is hashed
+    once, in a process pool handed chunksize keys at a time when there are
+    more than chunksize of them and workers is not 1.
+    """
+    keys = [bytes(key) for key in keys]
+    hashes = {}
+    missing = []
+    for key in dict.fromkeys(keys):
+        value = cache.get(key) if cache is not None else None
+        if value is None:
+            missing.append(key)
+        else:
+            hashes[key] = value
+
+    if workers == 1 or len(missing) <= chunksize:
+        computed = list(map(knot_hash, missing))
+    else:
+        with Pool(workers) as pool:
+            computed = pool.map(knot_hash, missing, chunksize)
+    for (key, value) in zip(missing, computed):
+        hashes[key] = value
+        if cache is not None:
+            cache.put(key, value)
+
+    return [hashes[key] for key in keys]
+
+ENGINES = {
+    'list': (cal_hash, hex_hash_fun),
+    'rotate': (cal_hash_rotated, hex_hash_bytes)
+}
+
 def main():
     """Knot Hash
 
@@ -70,17 +171,30 @@ def main():
                         required=True)
     parser.add_argument('-t', dest='type', choices=['multi', 'hex'],
                         default='multi', help='hash type')
+    parser.add_argument('-e', dest='engine', choices=ENGINES.keys(),
+                        default='rotate', help='hash engine')
+    parser.add_argument('-b', dest='batch', action='store_true',
+                        help='hex hash every line of the input as its own key')
+    parser.add_argument('-j', dest='workers', type=int,
+                        help='processes for batch hashing')
 
     args = parser.parse_args()
     with open(args.file_path, 'r') as file:
         input_data = file.readlines()
 
+    if args.batch:
+        keys = [line.rstrip('\n') for line in input_data]
+        for (key, value) in zip(keys, knot_hashes((key.encode() for key in keys), args.workers)):
+            print('%s: %s' % (key, value))
+        return
+
+    (hash_engine, hex_fun) = ENGINES[args.engine]
     if args.type == 'multi':
         data = [int(i) for j in input_data for i in j.split(",")]
-        value = cal_hash(data, multiplication_hash_fun)
+        value = hash_engine(data, multiplication_hash_fun)
     else:
         data = [ord(character) for line in input_data for character in line] + [17, 31, 73, 47, 23]
-        value = cal_hash(data, hex_hash_fun, 64)
+        value = hash_engine(data, hex_fun, 64)
 
     print('Hash value is: %s' % value)
 
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import argparse
+import importlib
+import json
+import sys
+import time
+import tracemalloc
+
+knot = importlib.import_module('10_knot_hash')
+
+INPUT_SIZES = [8, 64, 256]
+
+def make_key(size):
+    """Deterministic printable key of size bytes"""
+    return bytes(33 + (i * 7) % 94 for i in range(size))
+
+def make_cases(sizes):
+    """Benchmark name to zero argument function, one per function and input size"""
+    state = list(range(256))
+    sparse = knot.cal_hash(list(make_key(64)) + knot.HASH_SUFFIX, list, 64)
+    cases = {
+        'multiplication_hash_fun': lambda: knot.multiplication_hash_fun(sparse),
+        'dense/hex_hash_fun': lambda: knot.hex_hash_fun(sparse),
+        'dense/hex_hash_bytes': lambda: knot.hex_hash_bytes(bytes(sparse)),
+    }
+    for length in (16, 128, 256):
+        cases['reverse/%s' % length] = lambda length=length: knot.reverse(state, 200, length)
+
+    for size in sizes:
+        lengths = list(make_key(size)) + knot.HASH_SUFFIX
+        for (name, (engine, hex_fun)) in knot.ENGINES.items():
+            cases['sparse_round/%s/%s' % (name, size)] = (
+                lambda engine=engine, lengths=lengths: engine(lengths, list))
+            cases['hex_hash/%s/%s' % (name, size)] = (
+                lambda engine=engine, hex_fun=hex_fun, lengths=lengths: engine(lengths, hex_fun, 64))
+    return cases
+
+def measure(func, min_time=0.2, repeat=3):
+    """Best ops/sec over repeat runs of at least min_time seconds each, and
+    the peak bytes traced during one call"""
+    best = 0
+    for _ in range(repeat):
+        count = 0
+        start = time.perf_counter()
+        elapsed = 0
+        while elapsed < min_time:
+            func()
+            count += 1
+            elapsed = time.perf_counter() - start
+        best = max(best, count / elapsed)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'ops_per_sec': best, 'peak_bytes': peak}
+
+def run_benchmarks(sizes=INPUT_SIZES, min_time=0.2, repeat=3, only=None):
+    results = {}
+    for (name, func) in make_cases(sizes).items():
+        if only and only not in name:
+            continue
+        results[name] = measure(func, min_time, repeat)
+    return results
+
+def find_regressions(results, baseline, threshold):
+    """(name, baseline ops, current ops) of every benchmark slower than the
+    baseline by more than threshold percent"""
+    regressions = []
+    for (name, result) in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]['ops_per_sec']
+        if result['ops_per_sec'] < expected * (1 - threshold / 100):
+            regressions.append((name, expected, result['ops_per_sec']))
+    return regressions
+
+def main():
+    """Knot Hash Benchmark
+
+    Times the knot hash pieces across input sizes:
+    - sparse_round: one round of every length, list and rotate engines
+    - hex_hash: the full 64 round hex hash, list and rotate engines
+    - dense: folding the 256 numbers into the 16 byte dense hash
+    - reverse and multiplication_hash_fun on their own
+    Each benchmark reports ops/sec (best of the repeats) and the peak memory
+    of one call. Results can be saved as a baseline JSON, and compared with
+    one to fail when a benchmark loses more than the threshold percent of
+    its baseline throughput.
+    """
+    parser = argparse.ArgumentParser(description='Knot Hash Benchmark')
+    parser.add_argument('-s', dest='sizes', type=int, nargs='+', default=INPUT_SIZES,
+                        help='input sizes in bytes')
+    parser.add_argument('-m', dest='min_time', type=float, default=0.2,
+                        help='minimum seconds per timing run')
+    parser.add_argument('-r', dest='repeat', type=int, default=3,
+                        help='timing runs per benchmark')
+    parser.add_argument('-k', dest='only', help='only run benchmarks containing this')
+    parser.add_argument('-o', dest='output_path', help='file to save the results to as JSON')
+    parser.add_argument('-b', dest='baseline_path', help='baseline JSON to compare with')
+    parser.add_argument('-t', dest='threshold', type=float, default=10,
+                        help='allowed throughput regression in percent')
+
+    args = parser.parse_args()
+    results = run_benchmarks(args.sizes, args.min_time, args.repeat, args.only)
+    for (name, result) in results.items():
+        print('%-30s %12.1f ops/sec %10d peak bytes' % (name, result['ops_per_sec'], result['peak_bytes']))
+
+    if args.output_path:
+        with open(args.output_path, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+
+    if args.baseline_path:
+        with open(args.baseline_path, 'r') as file:
+            baseline = json.load(file)
+        regressions = find_regressions(results, baseline, args.threshold)
+        for (name, expected, actual) in regressions:
+            print('Regression in %s: %.1f ops/sec, baseline %.1f (-%.1f%%)' % (
+                name, actual, expected, 100 * (1 - actual / expected)))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,14 @@
 #!/usr/bin/env python3
 
 import argparse
+from array import array
+from functools import partial
+from multiprocessing import Pool
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 class Power:
     def __init__(self, x, y, serial_number):
@@ -58,7 +66,9 @@ class Power:
 
 class PowerGird:
     def __init__(self, w, h, serial_number):
-        self.data = [[Power(x+1, y+1, serial_number) for y in range(w)] for x in range(h)]
+        self.w = w
+        self.h = h
+        self.data = [[Power(x+1, y+1, serial_number) for y in range(h)] for x in range(w)]
 
     def get_cell_powers(self, x, y):
         return self.data[x-1][y-1]
@@ -66,18 +76,162 @@ class PowerGird:
     def set_cell_powers(self, x, y, powers):
         self.data[x-1][y-1] = powers
 
+    def max_square(self, size):
+        return find_max_power_square(self, size)
+
 def find_max_power_square(power_grid, size):
-    max_power = 0
+    max_power = None
     max_power_index = None
-    for x in range(1, 302 - size):
-        for y in range(1, 302 - size):
+    for x in range(1, power_grid.w - size + 2):
+        for y in range(1, power_grid.h - size + 2):
             power = calculate_square_power(power_grid, x, y, size)
-            if power > max_power:
+            if max_power is None or power > max_power:
                 max_power = power
                 max_power_index = (x, y)
 
     return (max_power_index, max_power)
 
+class PowerTable:
+    """Summed-area table of the grid, every square sum is answered in O(1)
+
+    The table is a flat array with a zero padded first row and column, stored
+    column by column (x major) so scanning it follows the same x then y order
+    as find_max_power_square.
+    """
+    def __init__(self, w, h, serial_number):
+        self.w = w
+        self.h = h
+        self.stride = h + 1
+        typecode = 'i' if fits_int32(w, h) else 'q'
+        self.table = array(typecode, bytes(array(typecode).itemsize * (w + 1) * self.stride))
+
+        stride = self.stride
+        table = self.table
+        for x in range(1, w + 1):
+            col_power = 0
+            for y in range(1, h + 1):
+                col_power += calculate_power(serial_number, x, y)
+                table[x * stride + y] = table[(x - 1) * stride + y] + col_power
+
+    def get_square_power(self, x, y, size):
+        stride = self.stride
+        table = self.table
+        x0 = (x - 1) * stride
+        x1 = (x - 1 + size) * stride
+        y1 = y - 1 + size
+        return table[x1 + y1] - table[x0 + y1] - table[x1 + y - 1] + table[x0 + y - 1]
+
+    def max_square(self, size):
+        stride = self.stride
+        table = self.table
+        max_power = None
+        max_power_index = None
+        for x in range(1, self.w - size + 2):
+            x0 = (x - 1) * stride
+            x1 = (x - 1 + size) * stride
+            top = table[x0:x0 + stride]
+            bottom = table[x1:x1 + stride]
+            powers = [b1 - t1 - b0 + t0 for (t0, t1, b0, b1) in
+                      zip(top, top[size:], bottom, bottom[size:])]
+            power = max(powers)
+            if max_power is None or power > max_power:
+                max_power = power
+                max_power_index = (x, powers.index(power) + 1)
+
+        return (max_power_index, max_power)
+
+class NumpyPowerTable:
+    """Summed-area table built from one vectorized power expression
+
+    Every square size is scanned at once as the difference of four shifted
+    views of the table, and the best corner is picked with argmax.
+    """
+    def __init__(self, w, h, serial_number):
+        if np is None:
+            raise ImportError('numpy is required for the numpy engine')
+
+        self.w = w
+        self.h = h
+        x = np.arange(1, w + 1, dtype=np.int64)[:, None]
+        y = np.arange(1, h + 1, dtype=np.int64)[None, :]
+        dtype = np.int32 if fits_int32(w, h) else np.int64
+        self.table = np.zeros((w + 1, h + 1), dtype=dtype)
+        self.table[1:, 1:] = calculate_power(serial_number, x, y)
+        self.table.cumsum(0, out=self.table)
+        self.table.cumsum(1, out=self.table)
+
+    def get_square_power(self, x, y, size):
+        table = self.table
+        x1 = x - 1 + size
+        y1 = y - 1 + size
+        return int(table[x1, y1] - table[x - 1, y1] - table[x1, y - 1] + table[x - 1, y - 1])
+
+    def max_square(self, size):
+        if size > min(self.w, self.h):
+            return (None, None)
+        table = self.table
+        powers = table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size]
+        (x, y) = np.unravel_index(powers.argmax(), powers.shape)
+        return ((int(x) + 1, int(y) + 1), int(powers[x, y]))
+
+def fits_int32(w, h):
+    # A square sum is the sum of 4 table entries, each at most 5 * w * h
+    return 20 * w * h < 2 ** 31
+
+PRUNE_TILES = 4
+
+def find_max_power_size(power_grid, max_size, prune=False):
+    """Find the square of any size up to max_size with the largest total power
+
+    With prune, a size is skipped without scanning the grid when an upper
+    bound of its power can not beat the best power found so far. The cache
+    engine grows each size from the previous one so it can not skip sizes.
+    """
+    if prune and isinstance(power_grid, PowerGird):
+        raise ValueError('cache engine has to sweep every size')
+
+    max_power = None
+    max_power_index = None
+    max_power_size = None
+    bounds = [None]
+    for size in range(1, min(max_size, power_grid.w, power_grid.h) + 1):
+        if prune and max_power is not None:
+            bound = square_power_bound(bounds, size)
+            if bound <= max_power:
+                bounds.append(bound)
+                continue
+
+        (index, power) = power_grid.max_square(size)
+        bounds.append(power)
+        if max_power is None or power > max_power:
+            max_power = power
+            max_power_index = index
+            max_power_size = size
+
+    return (max_power_index, max_power_size, max_power)
+
+def square_power_bound(bounds, size):
+    """Upper bound of any size x size square from the bounds of smaller sizes
+
+    The square is cut into k x k tiles of size a = size // k, the r = size % k
+    last rows and columns of tiles are one cell larger. a x a and (a+1) x (a+1)
+    tiles are bounded by their size's bound, a x (a+1) tiles by the a x a
+    bound plus the max cell power for each extra cell.
+    """
+    max_cell = bounds[1]
+    bound = None
+    for k in range(2, min(PRUNE_TILES, size) + 1):
+        (a, r) = divmod(size, k)
+        if r:
+            tiles = ((k - r) ** 2 * bounds[a] + r ** 2 * bounds[a + 1]
+                     + 2 * r * (k - r) * (bounds[a] + a * max_cell))
+        else:
+            tiles = k ** 2 * bounds[a]
+        if bound is None or tiles < bound:
+            bound = tiles
+
+    return bound
+
 def calculate_square_power(power_grid, x, y, size):
     power_cell = power_grid.get_cell_powers(x, y)
 
@@ -107,6 +261,39 @@ def calculate_power(serial_number, x, y):
     power_level = (rack_id * y + serial_number) * rack_id
     return (power_level // 100) % 10 - 5
 
+ENGINES = {
+    'cache': PowerGird,
+    'sat': PowerTable,
+    'numpy': NumpyPowerTable
+}
+
+def solve_serial(serial_number, max_size=300, engine='sat', w=300, h=300, prune=False):
+    power_grid = ENGINES[engine](w, h, serial_number)
+    return (serial_number,) + find_max_power_size(power_grid, max_size, prune)
+
+def solve_serials(serial_numbers, max_size=300, engine='sat', w=300, h=300,
+                  prune=False, workers=None, chunksize=1):
+    """Yield (serial, index, size, power) for every serial number
+
+    The size sweeps run in a process pool, results come back in the same
+    order as the serial numbers so the output is deterministic. A serial
+    takes seconds, so each one is its own task by default and every worker
+    stays busy even for small batches.
+    """
+    solve = partial(solve_serial, max_size=max_size, engine=engine, w=w, h=h, prune=prune)
+    with Pool(workers) as pool:
+        yield from pool.imap(solve, serial_numbers, chunksize)
+
+def read_serials(file_path):
+    with open(file_path, 'r') as file:
+        for line in file:
+            if line.strip():
+                yield int(line)
+
+def parse_serial_range(serial_range):
+    (start, end) = serial_range.split(':')
+    return range(int(start), int(end) + 1)
+
 def main():
     """
     You watch the Elves and their sleigh fade into the distance as they head toward the North Pole.
@@ -156,33 +343,55 @@ def main():
             -1  0   2  -5  -2
     """
     parser = argparse.ArgumentParser(description='Chronal Charge')
-    parser.add_argument('-n', dest='serial_number', help='serial number',
-                        required=True)
+    serials = parser.add_mutually_exclusive_group(required=True)
+    serials.add_argument('-n', dest='serial_number', help='serial number')
+    serials.add_argument('-i', dest='file_path',
+                         help='path to file of serial numbers, one per line')
+    serials.add_argument('-b', dest='serial_range',
+                         help='inclusive range of serial numbers, START:END')
     parser.add_argument('-s', dest='size', help='size',
                         required=False)
     parser.add_argument('-r', dest='range', help='range',
                         required=False)
+    parser.add_argument('-e', dest='engine', choices=ENGINES.keys(),
+                        default='sat', help='power grid engine')
+    parser.add_argument('-j', dest='workers', type=int,
+                        help='number of worker processes for batch mode')
+    parser.add_argument('-W', dest='width', type=int, default=300,
+                        help='grid width')
+    parser.add_argument('-H', dest='height', type=int, default=300,
+                        help='grid height')
+    parser.add_argument('-p', dest='prune', action='store_true',
+                        help='skip sizes that can not beat the best power')
 
     args = parser.parse_args()
 
+    if args.prune and args.engine == 'cache':
+        parser.error('-p can not be used with the cache engine')
+
+    if args.file_path or args.serial_range:
+        if args.file_path:
+            serial_numbers = read_serials(args.file_path)
+        else:
+            serial_numbers = parse_serial_range(args.serial_range)
+
+        max_size = int(args.range or max(args.width, args.height))
+        results = solve_serials(serial_numbers, max_size, args.engine, args.width,
+                                args.height, args.prune, args.workers)
+        for (serial, index, size, power) in results:
+            print('Serial: %s, Index: %s, Size: %s, Power: %s' % (serial, index, size, power), flush=True)
+        return
+
     serial_number = int(args.serial_number)
 
-    power_grid = PowerGird(300, 300, serial_number)
+    power_grid = ENGINES[args.engine](args.width, args.height, serial_number)
 
     if args.size:
-        (index, power) = find_max_power_square(power_grid, int(args.size))
+        (index, power) = power_grid.max_square(int(args.size))
         print('Index: %s, Power: %s' % (index, power))
 
     if args.range:
-        mpower = 0
-        mindex = None
-        mszie = None
-        for i in range(1, int(args.range)+1):
-            (index, power) = find_max_power_square(power_grid, i)
-            if power > mpower:
-                mpower = power
-                mindex = index
-                mszie = i
+        (mindex, mszie, mpower) = find_max_power_size(power_grid, int(args.range), args.prune)
         print('Index: %s, Size: %s, Power: %s' % (mindex, mszie, mpower))
 
 if __name__ == '__main__':
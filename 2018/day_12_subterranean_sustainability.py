@@ -1,54 +1,387 @@
 #!/usr/bin/env python3
 
 import argparse
+from functools import lru_cache, partial
 
 def add_pots_if_need(pots, start_pot_num):
     if '#' in pots[0:5]:
         pots = f".....{pots}"
         start_pot_num -= 5
-    if '#' in pots[-5:-1]:
+    if '#' in pots[-5:]:
         pots = f"{pots}....."
     return (pots, start_pot_num)
 
-def grow(pots, rules, gen_num):
-    start_pot_num = 0
-    stable_generation = None
-    generation_changes = []
+class StringPots:
+    """Pots kept as a string of '#' and '.', padded as the plants spread"""
+    def __init__(self, pots, rules):
+        self.pots = pots if isinstance(pots, str) else bits_to_pots(pots)
+        self.rule_mask = compile_rules(rules)
+        self.start_pot_num = 0
 
-    p_change = count_pots_num(pots, start_pot_num)
-    for gen in range(1, gen_num+1):
-        (pots, start_pot_num) = add_pots_if_need(pots, start_pot_num)
-
-        growed_pots = pots[0:2]
+    def next_generation(self):
+        (pots, self.start_pot_num) = add_pots_if_need(self.pots, self.start_pot_num)
 
+        # Rolling neighbourhood code, pot i+2 comes in as the highest bit
+        code = pots_to_bits(pots[0:4]) << 1
+        growed_pots = []
         for i in range(2, len(pots)-2):
-            rule = rules.get(pots[i-2:i+3])
-            if rule:
-                growed_pots += rule
+            code = (code >> 1) | ((pots[i+2] == '#') << 4)
+            growed_pots.append('#' if self.rule_mask >> code & 1 else '.')
+
+        self.pots = pots[0:2] + ''.join(growed_pots) + pots[-2:-1]
+
+    def count(self):
+        return count_pots_num(self.pots, self.start_pot_num)
+
+    def pattern(self):
+        plants = self.pots.strip('.')
+        offset = self.start_pot_num + self.pots.index('#') if plants else 0
+        return (plants, offset)
+
+    def translate(self, shift):
+        self.start_pot_num += shift
+
+    def __str__(self):
+        return self.pots
+
+class BitPots:
+    """Pots kept as a big int bitset, bit i is pot offset + i
+
+    A generation is computed for all pots at once: the 5 neighbours of every
+    pot are lined up by shifting the whole bitset, and the compiled rule
+    table is applied to them with word parallel and/or/not.
+    """
+    def __init__(self, pots, rules):
+        self.rule_mask = compile_rules(rules)
+        if self.rule_mask & 1:
+            raise ValueError('..... => # would fill the endless row of empty pots')
+
+        self.state = pots_to_bits(pots)
+        self.offset = 0
+        self.index_masks = []
+        self._trim()
+
+    def next_generation(self):
+        self.state = next_bits(self.state, self.rule_mask)
+        self.offset -= 2
+        self._trim()
+
+    def count(self):
+        state = self.state
+        while 1 << len(self.index_masks) < state.bit_length():
+            self.index_masks = bit_index_masks(2 * (1 << len(self.index_masks)))
+
+        # Sum of the set bit indexes, one popcount per bit of the index
+        index_sum = sum((state & mask).bit_count() << b for (b, mask) in enumerate(self.index_masks))
+        return self.offset * state.bit_count() + index_sum
+
+    def pattern(self):
+        return (self.state, self.offset if self.state else 0)
+
+    def translate(self, shift):
+        self.offset += shift
+
+    def _trim(self):
+        if self.state:
+            zeros = (self.state & -self.state).bit_length() - 1
+            self.state >>= zeros
+            self.offset += zeros
+
+    def __str__(self):
+        return bits_to_pots(self.state)
+
+class Node:
+    """Block of 2^level pots, a leaf holds its pots as bits"""
+    __slots__ = ('level', 'left', 'right', 'bits', 'population', 'index_sum')
+
+    def __init__(self, level, left=None, right=None, bits=0):
+        self.level = level
+        self.left = left
+        self.right = right
+        self.bits = bits
+        if left is None:
+            self.population = bits.bit_count()
+            self.index_sum = sum(i for i in range(1 << level) if bits >> i & 1)
+        else:
+            self.population = left.population + right.population
+            self.index_sum = left.index_sum + right.index_sum + (right.population << left.level)
+
+LEAF_LEVEL = 6
+LEAF_MASK = (1 << (1 << LEAF_LEVEL)) - 1
+
+class HashlifePots:
+    """Pots kept as a tree of interned blocks, advanced by memoized macro steps
+
+    The rules reach 2 pots to each side, so after 2^j generations the pots a
+    block of 2^k pots decides by itself are its centre half when j <= k - 3.
+    That result is cached per (block, j) with an LRU cap and built from the
+    results of smaller blocks, so every distinct block is evolved once and
+    the row can be moved forward by any power of two in one step.
+    """
+    def __init__(self, pots, rules, cache_size=1 << 20):
+        self.rule_mask = compile_rules(rules)
+        if self.rule_mask & 1:
+            raise ValueError('..... => # would fill the endless row of empty pots')
+
+        self.cache_size = cache_size
+        self.nodes = {}
+        self.empty_nodes = {}
+        self.step = lru_cache(maxsize=cache_size)(self._step)
+
+        state = pots_to_bits(pots)
+        leaf_bytes = 1 << (LEAF_LEVEL - 3)
+        data = state.to_bytes(state.bit_length() // 8 + leaf_bytes, 'little')
+        blocks = [self.leaf(int.from_bytes(data[i:i+leaf_bytes], 'little'))
+                  for i in range(0, len(data) - leaf_bytes + 1, leaf_bytes)]
+        while len(blocks) > 1 or blocks[0].level == LEAF_LEVEL:
+            if len(blocks) % 2:
+                blocks.append(self.empty(blocks[0].level))
+            blocks = [self.join(blocks[i], blocks[i+1]) for i in range(0, len(blocks), 2)]
+        self.root = blocks[0]
+        self.origin = 0
+
+    def leaf(self, bits):
+        return self._intern(bits, lambda: Node(LEAF_LEVEL, bits=bits))
+
+    def join(self, left, right):
+        return self._intern((left, right), lambda: Node(left.level + 1, left, right))
+
+    def _intern(self, key, make):
+        node = self.nodes.get(key)
+        if node is None:
+            if len(self.nodes) >= self.cache_size:
+                self.nodes.clear()
+            node = self.nodes[key] = make()
+        return node
+
+    def empty(self, level):
+        if level not in self.empty_nodes:
+            if level == LEAF_LEVEL:
+                self.empty_nodes[level] = self.leaf(0)
             else:
-                growed_pots += '.'
+                self.empty_nodes[level] = self.join(self.empty(level - 1), self.empty(level - 1))
+        return self.empty_nodes[level]
+
+    def centre(self, node):
+        if node.level == LEAF_LEVEL + 1:
+            half = 1 << (LEAF_LEVEL - 1)
+            return self.leaf((node.left.bits >> half) | (node.right.bits << half) & LEAF_MASK)
+        return self.join(node.left.right, node.right.left)
+
+    def _step(self, node, j):
+        """Centre half of the node after 2^j generations"""
+        if not node.population:
+            return self.empty(node.level - 1)
+
+        if node.level == LEAF_LEVEL + 1:
+            width = 1 << LEAF_LEVEL
+            bits = node.left.bits | node.right.bits << width
+            for _ in range(1 << j):
+                bits = (next_bits(bits, self.rule_mask) >> 2) & ((1 << 2 * width) - 1)
+            return self.leaf((bits >> (width // 2)) & LEAF_MASK)
+
+        (left, middle, right) = (node.left, self.join(node.left.right, node.right.left), node.right)
+        if j == node.level - 3:
+            # Half of the generations here and the other half below
+            j -= 1
+            parts = [self.step(left, j), self.step(middle, j), self.step(right, j)]
+        else:
+            parts = [self.centre(left), self.centre(middle), self.centre(right)]
+
+        return self.join(self.step(self.join(parts[0], parts[1]), j),
+                         self.step(self.join(parts[1], parts[2]), j))
+
+    def expand(self):
+        empty = self.empty(self.root.level - 1)
+        self.origin -= 1 << (self.root.level - 1)
+        self.root = self.join(self.join(empty, self.root.left), self.join(self.root.right, empty))
+
+    def is_centred(self):
+        # All plants are in the middle quarter of the root
+        root = self.root
+        if root.level < LEAF_LEVEL + 3:
+            return False
+        return root.population == root.left.right.right.population + root.right.left.left.population
 
-        pots = growed_pots + pots[-2:-1]
+    def advance(self, gen_num):
+        j = 0
+        while gen_num:
+            if gen_num & 1:
+                # The plants spread 2^(j+1) pots per side at most, which has
+                # to stay inside the centre half the step returns
+                while self.root.level < j + 4 or not self.is_centred():
+                    self.expand()
+                self.origin += 1 << (self.root.level - 2)
+                self.root = self.step(self.root, j)
+            gen_num >>= 1
+            j += 1
 
-        change = count_pots_num(pots, start_pot_num)
-        generation_changes.append(change - p_change)
-        p_change = change
+    def count(self):
+        return self.origin * self.root.population + self.root.index_sum
 
-        if len(generation_changes) > 50:
-            generation_changes.pop(0)
+    def __str__(self):
+        state = node_bits(self.root)
+        if state:
+            state >>= (state & -state).bit_length() - 1
+        return bits_to_pots(state)
 
-        # This means the plans expand consistent on both side with same amount.
-        # size 50 is kinda random
-        if len(generation_changes) == 50 and len(set(generation_changes)) == 1:
-            stable_generation = gen
+def node_bits(node):
+    if not node.population:
+        return 0
+    if node.left is None:
+        return node.bits
+    return node_bits(node.left) | node_bits(node.right) << (1 << node.left.level)
+
+def next_bits(state, rule_mask):
+    """Next generation of a bitset, bit i + 2 of the result is pot i"""
+    full = (1 << (state.bit_length() + 4)) - 1
+    # Bit i + 2 of the j-th shift holds neighbour j of pot i
+    neighbours = [state << (4 - j) for j in range(5)]
+    return apply_rules(rule_mask, 5, neighbours, full)
+
+def compile_rules(rules):
+    """Pack the rules into a 32 bit mask
+
+    Bit n of the mask is set when the neighbourhood with code n grows a plant,
+    pot j of the neighbourhood (from the left) is bit j of the code. An
+    already compiled mask is returned as it is.
+    """
+    if isinstance(rules, int):
+        return rules
+
+    rule_mask = 0
+    for (neighbourhood, result) in rules.items():
+        if result == '#':
+            rule_mask |= 1 << pots_to_bits(neighbourhood)
+    return rule_mask
+
+def apply_rules(table, n, neighbours, full):
+    """Evaluate a truth table of n neighbours over whole bitsets
+
+    The table is split on its highest neighbour (Shannon expansion) until
+    it is constant, so all pots go through the rules with a few big int ops.
+    """
+    if not table:
+        return 0
+    if table == (1 << (1 << n)) - 1:
+        return full
+
+    half = 1 << (n - 1)
+    low = apply_rules(table & ((1 << half) - 1), n - 1, neighbours, full)
+    high = apply_rules(table >> half, n - 1, neighbours, full)
+    return (neighbours[n-1] & high) | (~neighbours[n-1] & full & low)
+
+def bit_index_masks(width):
+    """Masks of the bits whose index has bit b set, for every b below width"""
+    masks = []
+    block = 1
+    while block < width:
+        mask = ((1 << block) - 1) << block
+        period = 2 * block
+        while period < width:
+            mask |= mask << period
+            period *= 2
+        masks.append(mask)
+        block *= 2
+    return masks
+
+def pots_to_bits(pots):
+    if isinstance(pots, int):
+        return pots
+    return int(pots[::-1].replace('#', '1').replace('.', '0') or '0', 2)
+
+def bits_to_pots(state):
+    return bin(state)[:1:-1].replace('1', '#').replace('0', '.')
+
+STATE_HEADER = b'initial state: '
+POT_DIGITS = bytes.maketrans(b'#.', b'10')
+CHUNK_SIZE = 1 << 20
+
+def load_input(file_path):
+    """Load the initial state as a bitset and the rules as a compiled mask
+
+    The initial state line is read in chunks and every chunk is translated
+    to binary digits straight from bytes, so a line of many MB never turns
+    into a Python string of pots.
+    """
+    rules = {}
+    with open(file_path, 'rb') as file:
+        if file.read(len(STATE_HEADER)) != STATE_HEADER:
+            raise ValueError('input has to start with %r' % STATE_HEADER.decode())
+
+        digits = bytearray()
+        rest = b''
+        for chunk in iter(partial(file.read, CHUNK_SIZE), b''):
+            (line, newline, rest) = chunk.partition(b'\n')
+            digits += line.translate(POT_DIGITS, b'\r')
+            if newline:
+                break
+
+        # Pot 0 is the first digit but has to be the lowest bit
+        digits.reverse()
+        state = int(digits or b'0', 2)
+
+        for line in (rest + file.read()).decode().splitlines():
+            if line:
+                (neighbourhood, result) = line.split(' => ')
+                rules[neighbourhood] = result
+
+    return (state, compile_rules(rules))
+
+def grow(pots, rules, gen_num, engine='string'):
+    """Grow the plants for gen_num generations
+
+    The live pattern (trimmed, with the pot number it starts at) is watched
+    for repeats with Brent's cycle detection, which only keeps one earlier
+    pattern around. Once it repeats the plants move by the same shift every
+    period, so the remaining periods are skipped in one jump.
+
+    Returns the plants, the sum of the pot numbers with a plant and the
+    (period, shift) of the cycle, or None if no cycle showed up in time.
+    """
+    plants = ENGINES[engine](pots, rules)
+    if isinstance(plants, HashlifePots):
+        plants.advance(gen_num)
+        return plants, plants.count(), None
+
+    (tortoise, tortoise_offset) = plants.pattern()
+    power = 1
+    period = 1
+    cycle = None
+
+    gen = 0
+    while gen < gen_num:
+        plants.next_generation()
+        gen += 1
+
+        (pattern, offset) = plants.pattern()
+        if pattern == tortoise:
+            cycle = (period, offset - tortoise_offset)
             break
 
-    gen_left = gen_num - (stable_generation or gen_num)
-    return pots, count_pots_num(pots, start_pot_num) + gen_left * generation_changes[-1]
+        if period == power:
+            (tortoise, tortoise_offset) = (pattern, offset)
+            power *= 2
+            period = 0
+        period += 1
+
+    if cycle:
+        (jumps, gen_left) = divmod(gen_num - gen, cycle[0])
+        for _ in range(gen_left):
+            plants.next_generation()
+        plants.translate(jumps * cycle[1])
+
+    return plants, plants.count(), cycle
 
 def count_pots_num(pots, start_pot_num):
     return sum(idx + start_pot_num for idx, pot in enumerate(list(pots)) if pot == '#')
 
+ENGINES = {
+    'string': StringPots,
+    'bits': BitPots,
+    'hashlife': HashlifePots
+}
+
 def main():
     """
     The pots are numbered, with 0 in front of you. To the left, the pots are
@@ -78,27 +411,20 @@ def main():
     parser = argparse.ArgumentParser(description='Subterranean Sustainability')
     parser.add_argument('-i', dest='file_path', help='path to input data file',
                         required=True)
-
-    init_state = None
-    rules = {}
+    parser.add_argument('-e', dest='engine', choices=ENGINES.keys(),
+                        default='bits', help='pots engine')
 
     args = parser.parse_args()
-    with open(args.file_path, 'r') as file:
-        lines = file.readlines()
-
-        init_state = lines[0].replace('\n', '').replace('initial state: ', '')
-
-        rule_strings = filter(None, [line.replace('\n', '') for line in lines[1:]])
-        for rs in rule_strings:
-            rule_data = rs.split(' => ')
-            rules[rule_data[0]] = rule_data[1]
+    (init_state, rules) = load_input(args.file_path)
 
-    (pots, count) = grow(init_state, rules, 20)
+    (pots, count, cycle) = grow(init_state, rules, 20, args.engine)
 
     print("Sum of pot num after %s generation: %s" % (20, count))
 
-    (pots, count) = grow(init_state, rules, 50000000000)
+    (pots, count, cycle) = grow(init_state, rules, 50000000000, args.engine)
 
+    if cycle:
+        print("Pattern repeats every %s generation, shifted by %s pots" % cycle)
     print("Sum of pot num after %s generation: %s" % (50000000000, count))
 
 if __name__ == '__main__':
@@ -1,6 +1,15 @@
 #!/usr/bin/env python3
 
 import argparse
+import heapq
+import mmap
+import os
+import re
+import sys
+import time
+from array import array
+from collections import deque
+from itertools import count
 
 CONNNERS = {
     '/': {
@@ -41,6 +50,8 @@ INTERSECTIONS = {
 }
 
 class Cart:
+    __slots__ = ('x', 'y', 'direct', 'inter_num', 'crash')
+
     def __init__(self, x, y, direct):
         self.x = x
         self.y = y
@@ -61,19 +72,115 @@ class Cart:
 class Track:
     def __init__(self, tracks):
         self.tracks = tracks
+        self.width = max(len(row) for row in tracks) + 1
+        self.height = len(tracks)
 
     def move_cart(self, cart):
         (x, y) = cart.next_track()
-        track = self.tracks[y][x]
-        if track in CONNNERS:
-            cart.direct = CONNNERS[track][cart.direct]
-        elif track == '+':
-            cart.direct = INTERSECTIONS[cart.direct][INTERSECTION_TURNS[cart.inter_num % 3]]
-            cart.inter_num += 1
+        turn_cart(cart, self.tracks[y][x])
 
         cart.x = x
         cart.y = y
 
+    def cells(self):
+        return ''.join(''.join(row).ljust(self.width - 1) + '\n' for row in self.tracks).encode()
+
+class FlatTrack:
+    """Track kept as one flat buffer of the input bytes
+
+    Every row takes width bytes including its newline, so the cell at (x, y)
+    is data[y * width + x]. The buffer can be a copy-on-write mmap of the
+    input file, carts only ever overwrite their own start cells.
+    """
+    def __init__(self, data, width):
+        self.data = data
+        self.width = width
+        self.height = len(data) // width
+
+    def move_cart(self, cart):
+        (x, y) = cart.next_track()
+        turn_cart(cart, chr(self.data[y * self.width + x]))
+
+        cart.x = x
+        cart.y = y
+
+    def cells(self):
+        return self.data
+
+def turn_cart(cart, track):
+    if track in CONNNERS:
+        cart.direct = CONNNERS[track][cart.direct]
+    elif track == '+':
+        cart.direct = INTERSECTIONS[cart.direct][INTERSECTION_TURNS[cart.inter_num % 3]]
+        cart.inter_num += 1
+
+TURN_TRACKS = set(CONNNERS) | {'+'}
+TURN_CELLS = frozenset(map(ord, TURN_TRACKS))
+
+class Segment:
+    """Straight track between two turn nodes, with the carts on it in order"""
+    __slots__ = ('low', 'high', 'step', 'carts')
+
+    def __init__(self, low, high, step):
+        self.low = low
+        self.high = high
+        self.step = step
+        self.carts = deque()
+
+class TrackGraph:
+    """Turn nodes (curves and intersections) of a track and the segments between them
+
+    Positions are flattened to y * width + x, moving along a segment adds
+    its step (1 or width) to the position.
+    """
+    def __init__(self, track):
+        self.width = track.width
+        self.cells = track.cells()
+        self.deltas = {'>': 1, '<': -1, 'v': self.width, '^': -self.width}
+        self.segments = {}
+        self.cell_segments = {}
+
+    def is_node(self, position):
+        return self.cells[position] in TURN_CELLS
+
+    def segment(self, node, direct):
+        """Segment leaving node in the direct direction and the node at its end"""
+        if (node, direct) not in self.segments:
+            delta = self.deltas[direct]
+            end = node + delta
+            while not self.is_node(end):
+                end += delta
+
+            step = abs(delta)
+            segment = Segment(min(node, end), max(node, end), step)
+            self.segments[(segment.low, '>' if step == 1 else 'v')] = (segment, segment.high)
+            self.segments[(segment.high, '<' if step == 1 else '^')] = (segment, segment.low)
+            for position in range(segment.low + step, segment.high, step):
+                self.cell_segments[position] = segment
+
+        return self.segments[(node, direct)]
+
+    def cell_segment(self, position, direct):
+        """Segment of a straight cell"""
+        if position not in self.cell_segments:
+            delta = self.deltas[direct]
+            node = position + delta
+            while not self.is_node(node):
+                node += delta
+            self.segment(node, OPPOSITES[direct])
+
+        return self.cell_segments[position]
+
+OPPOSITES = {'>': '<', '<': '>', 'v': '^', '^': 'v'}
+
+class SegmentCart(Cart):
+    """Cart that moves a whole segment at a time
+
+    The cart is at p0 at the start of tick t0 and moves delta every tick
+    until it reaches the node at the end of its segment.
+    """
+    __slots__ = ('flight', 't0', 'p0', 'delta', 'segment')
+
 def check_crash_cart(carts, cart):
     crashed_cart = (c for c in carts if not c == cart and not c.crash and cart.x == c.x and cart.y == c.y)
     return next(crashed_cart, None)
@@ -81,10 +188,90 @@ def check_crash_cart(carts, cart):
 def sort_carts(carts):
     return sorted(carts, key=lambda c: (c.y, c.x))
 
-def tick(tracks, carts):
-    # printTrack(tracks, carts)
-    first_crash = None
+class TickHooks:
+    """Callbacks of the tick engines, this base class ignores all of them
+
+    tick is called after every tick with the live carts in move order and
+    the seconds the tick took, crash on every collision as it happens.
+    When snapshot_every is set, snapshot gets the packed state (see
+    pack_carts) after every snapshot_every ticks.
+    """
+    snapshot_every = 0
+
+    def tick(self, tick_num, carts, seconds):
+        pass
+
+    def crash(self, tick_num, position):
+        pass
+
+    def snapshot(self, tick_num, data):
+        pass
+
+class TickRecorder(TickHooks):
+    """Keeps the time and cart count of every tick and the crashes,
+    snapshots are written over snapshot_path"""
+    def __init__(self, snapshot_path=None, snapshot_every=0):
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every if snapshot_path else 0
+        self.ticks = array('q')
+        self.seconds = array('d')
+        self.cart_counts = array('q')
+        self.crashes = []
+
+    def tick(self, tick_num, carts, seconds):
+        self.ticks.append(tick_num)
+        self.seconds.append(seconds)
+        self.cart_counts.append(len(carts))
+
+    def crash(self, tick_num, position):
+        self.crashes.append((tick_num, position))
+
+    def snapshot(self, tick_num, data):
+        partial_path = self.snapshot_path + '.part'
+        with open(partial_path, 'wb') as file:
+            file.write(data)
+        os.replace(partial_path, self.snapshot_path)
+
+    def summary(self):
+        if not self.seconds:
+            return 'No ticks run'
+        slowest = max(range(len(self.seconds)), key=self.seconds.__getitem__)
+        return 'Ticks: %s-%s, %.3fs total, slowest tick %s at %.6fs, %s crashes, %s carts left' % (
+            self.ticks[0], self.ticks[-1], sum(self.seconds), self.ticks[slowest],
+            self.seconds[slowest], len(self.crashes), self.cart_counts[-1])
+
+def end_tick(hooks, tick_num, carts, first_crash, started):
+    hooks.tick(tick_num, carts, time.perf_counter() - started)
+    if hooks.snapshot_every and tick_num % hooks.snapshot_every == 0 and len(carts) > 1:
+        hooks.snapshot(tick_num, pack_carts(tick_num, carts, first_crash))
+
+DIRECTIONS = '<>^v'
+
+def pack_carts(tick_num, carts, first_crash):
+    """State between two ticks as bytes: the tick number, the first crash
+    ((-1, -1) if none yet), then x, y, direction and next turn of each live cart"""
+    values = array('q', (tick_num,) + (first_crash or (-1, -1)))
+    for c in carts:
+        if not c.crash:
+            values.extend((c.x, c.y, DIRECTIONS.index(c.direct), c.inter_num % 3))
+    return values.tobytes()
+
+def unpack_carts(data):
+    """Inverse of pack_carts, returns (tick_num, first_crash, carts)"""
+    values = array('q')
+    values.frombytes(data)
+    (tick_num, crash_x, crash_y) = values[:3]
+    carts = []
+    for i in range(3, len(values), 4):
+        cart = Cart(values[i], values[i + 1], DIRECTIONS[values[i + 2]])
+        cart.inter_num = values[i + 3]
+        carts.append(cart)
+    return (tick_num, None if crash_x < 0 else (crash_x, crash_y), carts)
+
+def tick(tracks, carts, hooks=None, tick_num=0, first_crash=None):
     while True:
+        started = time.perf_counter()
+        tick_num += 1
         safe_carts = []
         for cart in carts:
             if cart.crash:
@@ -94,26 +281,298 @@ def tick(tracks, carts):
             if cc:
                 if not first_crash:
                     first_crash = (cc.x, cc.y)
+                if hooks:
+                    hooks.crash(tick_num, (cc.x, cc.y))
                 cc.crash = True
                 cart.crash = True
                 if cc in safe_carts:
                     safe_carts.remove(cc)
             else:
                 safe_carts.append(cart)
-        carts = safe_carts
-        if len(carts) == 1:
+        carts = sort_carts(safe_carts)
+        if hooks:
+            end_tick(hooks, tick_num, carts, first_crash, started)
+        if len(carts) <= 1:
             break
-        # printTrack(tracks, carts)
-        carts = sort_carts(carts)
-    return (first_crash, (carts[0].x, carts[0].y))
+    return (first_crash, (carts[0].x, carts[0].y) if carts else None)
+
+def tick_indexed(tracks, carts, hooks=None, tick_num=0, first_crash=None):
+    """Same as tick, but crashes are found through a position to cart index
 
-def printTrack(track, carts):
-    tracks = [[tc[:] for tc in tr] for tr in track.tracks]
+    Positions are flattened to y * width + x, which also sorts like (y, x).
+    The cart list is re-sorted in place every tick, carts only move one cell
+    so it is nearly sorted already and the sort stays close to linear.
+    """
+    width = tracks.width
+    occupied = {c.y * width + c.x: c for c in carts}
+    carts = sort_carts(carts)
+    while True:
+        started = time.perf_counter()
+        tick_num += 1
+        crashed = False
+        for cart in carts:
+            if cart.crash:
+                continue
+            del occupied[cart.y * width + cart.x]
+            tracks.move_cart(cart)
+            position = cart.y * width + cart.x
+            cc = occupied.pop(position, None)
+            if cc:
+                if not first_crash:
+                    first_crash = (cc.x, cc.y)
+                if hooks:
+                    hooks.crash(tick_num, (cc.x, cc.y))
+                cc.crash = True
+                cart.crash = True
+                crashed = True
+            else:
+                occupied[position] = cart
+        if crashed:
+            carts = [c for c in carts if not c.crash]
+        carts.sort(key=cart_position)
+        if hooks:
+            end_tick(hooks, tick_num, carts, first_crash, started)
+        if len(carts) <= 1:
+            break
+    return (first_crash, (carts[0].x, carts[0].y) if carts else None)
+
+ARRIVE = 0
+DEPART = 1
+CRASH = 2
+
+class SegmentSimulator:
+    """Moves carts from turn node to turn node instead of cell by cell
+
+    Every event happens in a tick at the position a cart starts that tick
+    from, so a heap of (tick, position) events replays them in the same order
+    as tick moves the carts. A cart only needs an event when it arrives at a
+    node, leaves it, or crashes. Crashes on a segment can only happen between
+    neighbouring carts there, which is computed when they become neighbours.
+    """
+    def __init__(self, tracks, carts):
+        self.graph = TrackGraph(tracks)
+        self.carts = [SegmentCart(c.x, c.y, c.direct) for c in carts]
+        self.alive = len(self.carts)
+        self.events = []
+        self.sequence = count()
+        self.node_visits = {}
+        self.first_crash = None
+
+    def run(self):
+        width = self.graph.width
+        segments = set()
+        for cart in sort_carts(self.carts):
+            position = cart.y * width + cart.x
+            self.fly(cart, 0, position, self.graph.cell_segment(position, cart.direct))
+            cart.segment.carts.append(cart)
+            segments.add(cart.segment)
+        for segment in segments:
+            for i in range(len(segment.carts) - 1):
+                self.check_neighbours(segment.carts[i], segment.carts[i+1], 0)
+
+        last_tick = 0 if self.alive <= 1 else None
+        while self.events:
+            (tick, position, _, kind, cart, flight, other, other_flight) = heapq.heappop(self.events)
+            if last_tick is not None and tick > last_tick:
+                break
+            if cart.crash or cart.flight != flight:
+                continue
+
+            if kind == ARRIVE:
+                self.arrive(cart, tick, position)
+            elif kind == DEPART:
+                self.depart(cart, tick, position)
+            elif not other.crash and other.flight == other_flight:
+                self.crash(cart, other, position + cart.delta, tick)
+
+            if last_tick is None and self.alive <= 1:
+                last_tick = tick
+
+        remaining = [c for c in self.carts if not c.crash]
+        if not remaining:
+            return (self.first_crash, None)
+        position = self.position_at(remaining[0], last_tick + 1)
+        return (self.first_crash, (position % width, position // width))
+
+    def schedule(self, tick, position, kind, cart, other=None):
+        heapq.heappush(self.events, (tick, position, next(self.sequence), kind, cart,
+                                     cart.flight, other, other and other.flight))
+
+    def fly(self, cart, tick, position, segment):
+        """Start moving the cart from position at the start of tick"""
+        cart.flight = getattr(cart, 'flight', 0) + 1
+        cart.t0 = tick
+        cart.p0 = position
+        cart.delta = self.graph.deltas[cart.direct]
+        cart.segment = segment
+
+        if not segment:
+            node = position + cart.delta
+        else:
+            node = segment.high if cart.delta > 0 else segment.low
+        moves = (node - position) // cart.delta
+        self.schedule(tick + moves - 1, node - cart.delta, ARRIVE, cart)
+
+    def position_at(self, cart, tick):
+        return cart.p0 + (tick - cart.t0) * cart.delta
+
+    def arrive(self, cart, tick, position):
+        node = position + cart.delta
+        if cart.segment:
+            if cart.delta > 0:
+                cart.segment.carts.pop()
+            else:
+                cart.segment.carts.popleft()
+            cart.segment = None
+
+        (other, other_tick) = self.node_visits.get(node, (None, None))
+        # The other cart is still on the node if it came this tick, or came
+        # last tick and has not left yet since it leaves from the node
+        if other and not other.crash and (other_tick == tick or (other_tick == tick - 1 and position < node)):
+            self.crash(cart, other, node, tick)
+            return
+
+        turn_cart(cart, chr(self.graph.cells[node]))
+        self.node_visits[node] = (cart, tick)
+        cart.flight += 1
+        cart.t0 = tick + 1
+        cart.p0 = node
+        self.schedule(tick + 1, node, DEPART, cart)
+
+    def depart(self, cart, tick, node):
+        if self.graph.is_node(node + self.graph.deltas[cart.direct]):
+            self.fly(cart, tick, node, None)
+            return
+
+        (segment, _) = self.graph.segment(node, cart.direct)
+        self.fly(cart, tick, node, segment)
+        if cart.delta > 0:
+            if segment.carts:
+                self.check_neighbours(cart, segment.carts[0], tick)
+            segment.carts.appendleft(cart)
+        else:
+            if segment.carts:
+                self.check_neighbours(segment.carts[-1], cart, tick)
+            segment.carts.append(cart)
+
+    def check_neighbours(self, left, right, tick):
+        """Schedule the crash of two neighbouring carts of a segment, if any
+
+        Between the two, the cart with the lower position moves first.
+        """
+        step = left.segment.step
+        left_position = self.position_at(left, tick)
+        right_position = self.position_at(right, tick)
+        gap = (right_position - left_position) // step
+        if left.delta > 0 and right.delta < 0:
+            # Head on, the gap closes by 2 every tick
+            ticks = (gap - 1) // 2
+            if gap % 2:
+                self.schedule(tick + ticks, left_position + ticks * step, CRASH, left, right)
+            else:
+                self.schedule(tick + ticks, right_position - ticks * step, CRASH, right, left)
+        elif left.delta > 0 and right.delta > 0 and gap == 1:
+            self.schedule(tick, left_position, CRASH, left, right)
+
+    def crash(self, cart, other, position, tick):
+        cart.crash = True
+        other.crash = True
+        self.alive -= 2
+        if not self.first_crash:
+            width = self.graph.width
+            self.first_crash = (position % width, position // width)
+
+        segment = cart.segment
+        if segment and segment is other.segment:
+            carts = segment.carts
+            i = min(carts.index(cart), carts.index(other))
+            left = carts[i-1] if i > 0 else None
+            right = carts[i+2] if i + 2 < len(carts) else None
+            del carts[i]
+            del carts[i]
+            if left and right:
+                self.check_neighbours(left, right, tick + 1)
+        else:
+            for c in (cart, other):
+                if c.segment:
+                    c.segment.carts.remove(c)
+
+def tick_segments(tracks, carts):
+    return SegmentSimulator(tracks, carts).run()
+
+def cart_position(cart):
+    return (cart.y, cart.x)
+
+CART_CELLS = re.compile(rb'[<>^v]')
+CART_TRACKS = {'<': '-', '>': '-', '^': '|', 'v': '|'}
+
+def count_newlines(data):
+    count = 0
+    position = data.find(b'\n')
+    while position >= 0:
+        count += 1
+        position = data.find(b'\n', position + 1)
+    return count
+
+def load_track(file_path):
+    """Map the input file into a FlatTrack and pull the carts out of it
+
+    The carts are found with one regex scan over the buffer and their cells
+    are replaced by the track under them. Rows of different lengths (any
+    newline off the stride) or a missing final newline fall back to a
+    padded bytearray copy. An empty file is an empty track without carts.
+    """
+    if os.path.getsize(file_path) == 0:
+        return (FlatTrack(bytearray(), 1), [])
+
+    with open(file_path, 'rb') as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    width = data.find(b'\n') + 1
+    rows = len(data) // width if width else 0
+    if (not width or len(data) % width or count_newlines(data) != rows or
+            data[width - 1::width] != b'\n' * rows):
+        lines = data[:].splitlines()
+        data.close()
+        width = max(len(line) for line in lines) + 1
+        data = bytearray(b''.join(line.ljust(width - 1) + b'\n' for line in lines))
+
+    carts = []
+    for match in CART_CELLS.finditer(data):
+        (y, x) = divmod(match.start(), width)
+        direct = match.group().decode()
+        carts.append(Cart(x, y, direct))
+    for cart in carts:
+        data[cart.y * width + cart.x] = ord(CART_TRACKS[cart.direct])
+
+    return (FlatTrack(data, width), carts)
+
+def printTrack(track, carts, out=None):
+    """Write the track rows straight from its cells, only rows with carts are copied"""
+    out = out or sys.stdout.buffer
+    cells = memoryview(track.cells())
+    width = track.width
+    rows = {}
     for c in carts:
         if not c.crash:
-            tracks[c.y][c.x] = c.direct
+            rows.setdefault(c.y, []).append(c)
+
+    sys.stdout.flush()
+    for y in range(track.height):
+        row = cells[y * width:(y + 1) * width]
+        if y in rows:
+            row = bytearray(row)
+            for c in rows[y]:
+                row[c.x] = ord(c.direct)
+        out.write(row)
+    out.flush()
+    cells.release()
 
-    print('\n'.join([''.join(t) for t in tracks]))
+ENGINES = {
+    'scan': tick,
+    'index': tick_indexed,
+    'segment': tick_segments
+}
 
 def main():
     """
@@ -156,28 +615,44 @@ def main():
     parser = argparse.ArgumentParser(description='Mine Cart Madness')
     parser.add_argument('-i', dest='file_path', help='path to input data file',
                         required=True)
+    parser.add_argument('-e', dest='engine', choices=ENGINES.keys(),
+                        default='index', help='cart simulation engine')
+    parser.add_argument('-p', dest='profile', action='store_true',
+                        help='print a tick timing summary to stderr')
+    parser.add_argument('-c', dest='snapshot_path',
+                        help='file to write cart snapshots to')
+    parser.add_argument('-k', dest='snapshot_every', type=int, default=1000,
+                        help='ticks between snapshots')
+    parser.add_argument('-r', dest='resume_path',
+                        help='snapshot file to resume the run from')
 
-    tracks = []
-    carts = []
     args = parser.parse_args()
-    with open(args.file_path, 'r') as file:
-        for row, line in enumerate(file.read().splitlines()):
-            row_tracks = []
-            for col, t in enumerate(list(line)):
-                if t == '<' or t == '>':
-                    row_tracks.append('-')
-                    carts.append(Cart(col, row, t))
-                elif t == 'v' or t == '^':
-                    row_tracks.append('|')
-                    carts.append(Cart(col, row, t))
-                else:
-                    row_tracks.append(t)
-            tracks.append(row_tracks)
-
-    track = Track(tracks)
-    (first_crash, remaining) = tick(track, carts)
-    print('First crash at: %s, %s' % first_crash)
-    print('Last cart at: %s, %s' % remaining)
+    ticking = args.profile or args.snapshot_path or args.resume_path
+    if ticking and args.engine == 'segment':
+        parser.error('the segment engine does not run tick by tick')
+    if args.snapshot_every < 1:
+        parser.error('snapshots need at least one tick between them')
+
+    (track, carts) = load_track(args.file_path)
+    if not ticking:
+        (first_crash, remaining) = ENGINES[args.engine](track, carts)
+    else:
+        (tick_num, first_crash) = (0, None)
+        if args.resume_path:
+            with open(args.resume_path, 'rb') as file:
+                (tick_num, first_crash, carts) = unpack_carts(file.read())
+        recorder = TickRecorder(args.snapshot_path, args.snapshot_every)
+        (first_crash, remaining) = ENGINES[args.engine](track, carts, recorder, tick_num, first_crash)
+        if args.profile:
+            print(recorder.summary(), file=sys.stderr)
+    if first_crash is None:
+        print('No crash')
+    else:
+        print('First crash at: %s, %s' % first_crash)
+    if remaining is None:
+        print('No cart left')
+    else:
+        print('Last cart at: %s, %s' % remaining)
 
 if __name__ == '__main__':
     main()
@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
 
 import argparse
+import mmap
+import os
+import struct
+from collections import deque
+from functools import partial
 
 def make_recipes(num, stopper):
     recipes = '37'
@@ -23,6 +28,210 @@ def num_of_recipes_made_for(recipes, num):
     if num in recipes[-len(num)-1:]:
         return recipes.index(num)
 
+DIGIT_CHARS = bytes.maketrans(bytes(range(10)), b'0123456789')
+SEARCH_CHUNK = 1 << 20
+
+class RecipeBoard:
+    """Scoreboard of integer digits in a bytearray
+
+    size recipes are made, the rest of the bytearray is spare room that
+    doubles whenever a round could run past it.
+    """
+    def __init__(self, capacity=SEARCH_CHUNK):
+        self.digits = bytearray(max(capacity, 4))
+        self.digits[0] = 3
+        self.digits[1] = 7
+        self.size = 2
+        self.elf1 = 0
+        self.elf2 = 1
+
+    def extend(self, count):
+        """Make recipes until there are at least count of them"""
+        digits = self.digits
+        capacity = len(digits)
+        size = self.size
+        elf1 = self.elf1
+        elf2 = self.elf2
+        while size < count:
+            if size + 2 > capacity:
+                digits = self.grow()
+                capacity = len(digits)
+            score1 = digits[elf1]
+            score2 = digits[elf2]
+            combined = score1 + score2
+            if combined >= 10:
+                digits[size] = 1
+                digits[size + 1] = combined - 10
+                size += 2
+            else:
+                digits[size] = combined
+                size += 1
+            elf1 += score1 + 1
+            if elf1 >= size:
+                elf1 %= size
+            elf2 += score2 + 1
+            if elf2 >= size:
+                elf2 %= size
+        self.size = size
+        self.elf1 = elf1
+        self.elf2 = elf2
+
+    def grow(self):
+        self.digits.extend(bytes(len(self.digits)))
+        return self.digits
+
+    def scores(self, start, stop):
+        return bytes(self.digits[start:min(stop, self.size)]).translate(DIGIT_CHARS).decode()
+
+    def find(self, scores, start=0):
+        return self.digits.find(bytes(map(int, scores)), start, self.size)
+
+BOARD_HEADER = struct.Struct('<8sQQQ')
+BOARD_MAGIC = b'RECIPES1'
+
+class FileRecipeBoard(RecipeBoard):
+    """RecipeBoard kept in a memory-mapped file so it outlives the process
+
+    The file starts with a header of the magic, size and both elf
+    positions, the digits follow it. Opening an existing file picks the
+    board up where the last run stopped, the header is rewritten after
+    every extend.
+    """
+    def __init__(self, file_path, capacity=SEARCH_CHUNK):
+        if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+            with open(file_path, 'wb') as file:
+                file.write(BOARD_HEADER.pack(BOARD_MAGIC, 2, 0, 1))
+                file.write(bytes([3, 7]) + bytes(max(capacity, 4) - 2))
+
+        with open(file_path, 'r+b') as file:
+            self.map = mmap.mmap(file.fileno(), 0)
+        (magic, self.size, self.elf1, self.elf2) = BOARD_HEADER.unpack_from(self.map)
+        if magic != BOARD_MAGIC:
+            self.map.close()
+            raise ValueError('%s is not a recipe scoreboard' % file_path)
+        self.digits = memoryview(self.map)[BOARD_HEADER.size:]
+
+    def extend(self, count):
+        super().extend(count)
+        BOARD_HEADER.pack_into(self.map, 0, BOARD_MAGIC, self.size, self.elf1, self.elf2)
+
+    def grow(self):
+        capacity = len(self.digits)
+        self.digits.release()
+        self.map.resize(BOARD_HEADER.size + capacity * 2)
+        self.digits = memoryview(self.map)[BOARD_HEADER.size:]
+        return self.digits
+
+    def find(self, scores, start=0):
+        index = self.map.find(bytes(map(int, scores)), BOARD_HEADER.size + start,
+                              BOARD_HEADER.size + self.size)
+        return index - BOARD_HEADER.size if index >= 0 else index
+
+    def close(self):
+        self.digits.release()
+        self.map.flush()
+        self.map.close()
+
+def board_scores_after(num, board=None):
+    board = board or RecipeBoard(int(num) + 12)
+    board.extend(int(num) + 11)
+    return board.scores(int(num), int(num) + 10)
+
+def board_recipes_before(num, board=None):
+    board = board or RecipeBoard()
+    searched = 0
+    while True:
+        index = board.find(num, searched)
+        if index >= 0:
+            return index
+        searched = max(board.size - len(num) + 1, 0)
+        board.extend(board.size + min(board.size + 1024, SEARCH_CHUNK))
+
+class DigitMatcher:
+    """Aho-Corasick automaton that finds many score sequences in one pass
+
+    Each state has all 10 digit transitions in the flat goto list, so a
+    digit is consumed with one lookup: goto[state * 10 + digit]. found maps
+    each target to the index of its first occurrence.
+    """
+    def __init__(self, targets):
+        self.targets = list(dict.fromkeys(targets))
+        goto = [-1] * 10
+        outputs = [()]
+        for target in self.targets:
+            if not target.isdigit():
+                raise ValueError('%r is not a sequence of scores' % target)
+            state = 0
+            for digit in map(int, target):
+                if goto[state * 10 + digit] < 0:
+                    goto[state * 10 + digit] = len(outputs)
+                    goto.extend([-1] * 10)
+                    outputs.append(())
+                state = goto[state * 10 + digit]
+            outputs[state] += (target,)
+
+        fail = [0] * len(outputs)
+        queue = deque()
+        for digit in range(10):
+            if goto[digit] < 0:
+                goto[digit] = 0
+            else:
+                queue.append(goto[digit])
+        while queue:
+            state = queue.popleft()
+            outputs[state] += outputs[fail[state]]
+            for digit in range(10):
+                fallback = goto[fail[state] * 10 + digit]
+                if goto[state * 10 + digit] < 0:
+                    goto[state * 10 + digit] = fallback
+                else:
+                    fail[goto[state * 10 + digit]] = fallback
+                    queue.append(goto[state * 10 + digit])
+
+        self.goto = goto
+        self.outputs = outputs
+        self.state = 0
+        self.position = 0
+        self.found = {}
+
+    def done(self):
+        return len(self.found) == len(self.targets)
+
+    def feed(self, digits):
+        """Consume the next digits of the scoreboard, stops early once
+        every target is found. Returns whether they all are."""
+        goto = self.goto
+        outputs = self.outputs
+        found = self.found
+        state = self.state
+        position = self.position
+        for digit in digits:
+            state = goto[state * 10 + digit]
+            position += 1
+            if outputs[state]:
+                for target in outputs[state]:
+                    if target not in found:
+                        found[target] = position - len(target)
+                if self.done():
+                    break
+        self.state = state
+        self.position = position
+        return self.done()
+
+def board_recipes_before_all(targets, board=None):
+    """First index of every target, all searched in one pass over the board"""
+    matcher = DigitMatcher(targets)
+    board = board or RecipeBoard()
+    while not matcher.feed(board.digits[matcher.position:board.size]):
+        board.extend(board.size + min(board.size + 1024, SEARCH_CHUNK))
+    return matcher.found
+
+ENGINES = {
+    'string': (partial(make_recipes, stopper=next_x_recipes_after),
+               partial(make_recipes, stopper=num_of_recipes_made_for)),
+    'board': (board_scores_after, board_recipes_before)
+}
+
 def main():
     """
     The Elves are trying to come up with the ultimate hot chocolate recipe;
@@ -54,13 +263,40 @@ def main():
     parser = argparse.ArgumentParser(description='Chocolate Charts')
     parser.add_argument('-n', dest='num', help='number of recipes make',
                         required=True)
+    parser.add_argument('-e', dest='engine', choices=ENGINES.keys(),
+                        default='board', help='scoreboard engine')
+    parser.add_argument('-t', dest='targets', action='append', default=[],
+                        help='more score sequences to find, all in one pass')
+    parser.add_argument('-c', dest='cache_path',
+                        help='scoreboard file to resume from and extend')
 
     args = parser.parse_args()
-    scores = make_recipes(args.num, next_x_recipes_after)
+    if args.cache_path and args.engine != 'board':
+        parser.error('only the board engine can use a scoreboard file')
+
+    (scores_after, recipes_before) = ENGINES[args.engine]
+    board = None
+    if args.engine == 'board':
+        try:
+            board = FileRecipeBoard(args.cache_path) if args.cache_path else RecipeBoard()
+        except ValueError as e:
+            parser.error(str(e))
+        scores_after = partial(scores_after, board=board)
+        recipes_before = partial(recipes_before, board=board)
+    scores = scores_after(args.num)
     print('After %s recipes, next 10 score is: %s' % (args.num, scores))
 
-    num_recipes = make_recipes(args.num, num_of_recipes_made_for)
+    num_recipes = recipes_before(args.num)
     print('After recipes %s appear, number of recipes created: %s' % (args.num, num_recipes))
 
+    if args.targets:
+        found = board_recipes_before_all(args.targets, board)
+        for target in dict.fromkeys(args.targets):
+            num_recipes = found[target]
+            print('After recipes %s appear, number of recipes created: %s' % (target, num_recipes))
+
+    if args.cache_path:
+        board.close()
+
 if __name__ == '__main__':
     main()
@@ -1,7 +1,16 @@
 #!/usr/bin/env python3
 
 import argparse
+import math
+import mmap
+import os
 import re
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 class Claim:
     def __init__(self, claim_string):
@@ -14,6 +23,17 @@ class Claim:
         self.height = int(height)
         self.overlap = False
 
+    @classmethod
+    def from_fields(cls, cid, x_index, y_index, width, height):
+        claim = cls.__new__(cls)
+        claim.id = cid
+        claim.x_index = x_index
+        claim.y_index = y_index
+        claim.width = width
+        claim.height = height
+        claim.overlap = False
+        return claim
+
     def get_inches(self):
         x_range = range(self.x_index, self.x_index + self.width)
         y_range = range(self.y_index, self.y_index + self.height)
@@ -47,6 +67,126 @@ def get_overlap_area(claims):
 
     return overlap_area
 
+CLAIM_SEPARATORS = bytes.maketrans(b'#@,:x', b'     ')
+
+class ClaimColumns:
+    """Claims as parallel array columns: ids, x, y, w and h"""
+    def __init__(self, ids, x, y, w, h):
+        self.ids = ids
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+
+    def __len__(self):
+        return len(self.ids)
+
+    def claim(self, row):
+        return Claim.from_fields(self.ids[row], self.x[row], self.y[row], self.w[row], self.h[row])
+
+def parse_claims(data):
+    """Columns of every claim in data (bytes-like)
+
+    The claim punctuation is translated to spaces in one pass, leaving five
+    whitespace separated numbers per claim, which numpy (or int() without
+    it) converts in bulk.
+    """
+    data = bytes(data)
+    text = data.translate(CLAIM_SEPARATORS)
+    values = array('q')
+    if np is not None:
+        values.frombytes(np.fromstring(text, dtype=np.int64, sep=' ').tobytes())
+    else:
+        values.extend(map(int, text.split()))
+    if len(values) != 5 * data.count(b'#'):
+        raise ValueError('claims must look like #1 @ 906,735: 28x17')
+    return ClaimColumns(*(values[i::5] for i in range(5)))
+
+def load_claims(file_path):
+    if os.path.getsize(file_path) == 0:
+        return parse_claims(b'')
+    with open(file_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return parse_claims(data)
+
+def claim_columns(claims):
+    if isinstance(claims, ClaimColumns):
+        return claims
+    return parse_claims('\n'.join(claims).encode())
+
+class CoverageTree:
+    """Segment tree over the gaps between sorted edges
+
+    count holds how many rectangles cover a node's whole range, once and
+    twice the length of the range covered by at least one and at least
+    two rectangles.
+    """
+    def __init__(self, edges):
+        self.edges = edges
+        self.size = len(edges) - 1
+        self.count = [0] * (4 * self.size)
+        self.once = [0] * (4 * self.size)
+        self.twice = [0] * (4 * self.size)
+
+    def update(self, low, high, delta, node=1, left=0, right=None):
+        """Add delta cover to the gaps low to high (exclusive)"""
+        if right is None:
+            right = self.size
+        if high <= left or right <= low:
+            return
+        if low <= left and right <= high:
+            self.count[node] += delta
+        else:
+            mid = (left + right) // 2
+            self.update(low, high, delta, 2 * node, left, mid)
+            self.update(low, high, delta, 2 * node + 1, mid, right)
+        self._pull(node, left, right)
+
+    def _pull(self, node, left, right):
+        count = self.count[node]
+        leaf = right - left == 1
+        if count >= 2:
+            self.once[node] = self.twice[node] = self.edges[right] - self.edges[left]
+        elif count == 1:
+            self.once[node] = self.edges[right] - self.edges[left]
+            self.twice[node] = 0 if leaf else self.once[2 * node] + self.once[2 * node + 1]
+        else:
+            self.once[node] = 0 if leaf else self.once[2 * node] + self.once[2 * node + 1]
+            self.twice[node] = 0 if leaf else self.twice[2 * node] + self.twice[2 * node + 1]
+
+def sweep_overlap_area(claims):
+    """Overlapped area from a sweep over the claims' left and right edges
+
+    The y edges are compressed into a CoverageTree, every x edge adds or
+    removes a claim from it, and the area between two x edges is the width
+    times the length covered twice.
+    """
+    columns = claim_columns(claims)
+    rects = [r for r in zip(columns.x, columns.y, columns.w, columns.h) if r[2] and r[3]]
+    if not rects:
+        return 0
+
+    ys = sorted({y for (_, y, _, _) in rects} | {y + h for (_, y, _, h) in rects})
+    y_slots = {y: i for (i, y) in enumerate(ys)}
+    events = []
+    for (x, y, w, h) in rects:
+        (low, high) = (y_slots[y], y_slots[y + h])
+        events.append((x, 1, low, high))
+        events.append((x + w, -1, low, high))
+    events.sort()
+
+    tree = CoverageTree(ys)
+    area = 0
+    last_x = events[0][0]
+    for (x, delta, low, high) in events:
+        area += tree.twice[1] * (x - last_x)
+        last_x = x
+        tree.update(low, high, delta)
+    return area
+
+def grid_overlap_area(claims):
+    return len(get_overlap_area(claims))
+
 def get_non_overlap(claims):
     area_used = [[[] for i in range(1000)] for j in range(1000)]
     claim_map = {}
@@ -67,6 +207,111 @@ def get_non_overlap(claims):
         if not claim.overlap:
             return claim
 
+class ClaimIndex:
+    """Static R-tree over the claim rectangles of a ClaimColumns
+
+    Entries are (x1, y1, x2, y2, item) with exclusive x2/y2. A leaf entry's
+    item is the claim row, a node's item is the list of its child entries.
+    The tree is bulk loaded with sort-tile-recursive packing, node_size
+    entries per node, so its size only depends on the number of claims.
+    """
+    def __init__(self, columns, node_size=16):
+        self.columns = columns
+        self.node_size = node_size
+        level = [(columns.x[i], columns.y[i], columns.x[i] + columns.w[i],
+                  columns.y[i] + columns.h[i], i)
+                 for i in range(len(columns)) if columns.w[i] and columns.h[i]]
+        while len(level) > 1:
+            level = self._pack(level)
+        self.root = level[0] if level else None
+
+    def _pack(self, entries):
+        size = self.node_size
+        node_count = -(-len(entries) // size)
+        slab_len = size * math.ceil(math.sqrt(node_count))
+        entries.sort(key=lambda e: e[0] + e[2])
+        nodes = []
+        for i in range(0, len(entries), slab_len):
+            slab = sorted(entries[i:i + slab_len], key=lambda e: e[1] + e[3])
+            for j in range(0, len(slab), size):
+                group = slab[j:j + size]
+                nodes.append((min(e[0] for e in group), min(e[1] for e in group),
+                              max(e[2] for e in group), max(e[3] for e in group), group))
+        return nodes
+
+    def _search(self, row):
+        columns = self.columns
+        (x1, y1) = (columns.x[row], columns.y[row])
+        (x2, y2) = (x1 + columns.w[row], y1 + columns.h[row])
+        if x1 == x2 or y1 == y2 or self.root is None:
+            return
+        stack = [self.root]
+        while stack:
+            entry = stack.pop()
+            if entry[0] < x2 and x1 < entry[2] and entry[1] < y2 and y1 < entry[3]:
+                if isinstance(entry[4], list):
+                    stack.extend(entry[4])
+                elif entry[4] != row:
+                    yield entry[4]
+
+    def intersecting(self, row):
+        """Rows of the other claims sharing at least one inch with row"""
+        return sorted(self._search(row))
+
+    def overlaps_any(self, row):
+        return next(self._search(row), None) is not None
+
+def indexed_non_overlap(claims):
+    columns = claim_columns(claims)
+    index = ClaimIndex(columns)
+    for row in range(len(columns)):
+        if not index.overlaps_any(row):
+            return columns.claim(row)
+
+def numpy_claim_coverage(claims):
+    """Overlapped area and the first claim overlapping no other, from one parse
+
+    Coverage counts come from a 2D difference array: +1 at the top left
+    and bottom right corner of every claim, -1 at the other two, then a
+    cumulative sum along both axes. A claim overlaps nothing when the
+    coverage summed over it, read from a summed-area table, equals its area.
+    """
+    if np is None:
+        raise ImportError('numpy is required for the numpy engine')
+
+    columns = claim_columns(claims)
+    if not len(columns):
+        return (0, None)
+    (x, y, w, h) = (np.frombuffer(column, dtype=np.int64)
+                    for column in (columns.x, columns.y, columns.w, columns.h))
+    (x2, y2) = (x + w, y + h)
+
+    diff = np.zeros((x2.max() + 1, y2.max() + 1), dtype=np.int32)
+    np.add.at(diff, (x, y), 1)
+    np.add.at(diff, (x2, y), -1)
+    np.add.at(diff, (x, y2), -1)
+    np.add.at(diff, (x2, y2), 1)
+    coverage = diff.cumsum(axis=0, out=diff).cumsum(axis=1, out=diff)
+    overlap_area = int(np.count_nonzero(coverage >= 2))
+
+    table = np.zeros(coverage.shape, dtype=np.int64)
+    coverage[:-1, :-1].cumsum(axis=0, out=table[1:, 1:]).cumsum(axis=1, out=table[1:, 1:])
+    covered = table[x2, y2] - table[x, y2] - table[x2, y] + table[x, y]
+    alone = np.flatnonzero(covered == w * h)
+    return (overlap_area, columns.claim(int(alone[0])) if len(alone) else None)
+
+def numpy_overlap_area(claims):
+    return numpy_claim_coverage(claims)[0]
+
+def numpy_non_overlap(claims):
+    return numpy_claim_coverage(claims)[1]
+
+ENGINES = {
+    'grid': (grid_overlap_area, get_non_overlap),
+    'sweep': (sweep_overlap_area, indexed_non_overlap),
+    'numpy': (numpy_overlap_area, numpy_non_overlap)
+}
+
 def main():
     """
     The whole piece of fabric they're working on is a very large square - at least
@@ -117,14 +362,23 @@ def main():
     parser = argparse.ArgumentParser(description='No matter how to slice it')
     parser.add_argument('-i', dest='file_path', help='path to input data file',
                         required=True)
+    parser.add_argument('-e', dest='engine', choices=ENGINES.keys(),
+                        default='sweep', help='overlap area engine')
 
     args = parser.parse_args()
-    with open(args.file_path, 'r') as file:
-        input_data = file.readlines()
+    if args.engine == 'grid':
+        with open(args.file_path, 'r') as file:
+            input_data = file.readlines()
+    else:
+        input_data = load_claims(args.file_path)
 
-    o_area = get_overlap_area(input_data)
-    print('Number of inches overlap: %s' % len(o_area))
-    no_overlap = get_non_overlap(input_data)
+    if args.engine == 'numpy':
+        (o_area, no_overlap) = numpy_claim_coverage(input_data)
+    else:
+        (overlap_area, non_overlap) = ENGINES[args.engine]
+        o_area = overlap_area(input_data)
+        no_overlap = non_overlap(input_data)
+    print('Number of inches overlap: %s' % o_area)
     print('No overlap claim id: %s' % no_overlap.id)
 
 if __name__ == '__main__':
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 
 import argparse
+import os
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
 
 def reduce(polymer, ignore_unit=''):
     reduced = []
@@ -29,6 +33,139 @@ def find_shorest_polymer(polymer):
                 shortest = reduced
     return shortest
 
+# Byte level tables, built from the same str.upper() rules reduce uses:
+# UNIT_PARTNERS[b] is the unit b reacts with (-1 for none), UNIT_TYPES[b]
+# the type of b and UNIT_GROUPS every byte of a type.
+UNIT_TYPES = [chr(b).upper() for b in range(256)]
+UNIT_GROUPS = {}
+for b in range(256):
+    UNIT_GROUPS[UNIT_TYPES[b]] = UNIT_GROUPS.get(UNIT_TYPES[b], b'') + bytes([b])
+UNIT_PARTNERS = [next((p for p in UNIT_GROUPS[UNIT_TYPES[b]] if p != b), -1) for b in range(256)]
+
+def encode_polymer(polymer):
+    return polymer.encode('latin-1')
+
+def reduce_units(units, ignore=b''):
+    """reduce on encoded units, dropping the bytes in ignore"""
+    partners = UNIT_PARTNERS
+    reduced = bytearray()
+    for c in units:
+        if c in ignore:
+            continue
+        if reduced and reduced[-1] == partners[c]:
+            del reduced[-1]
+        else:
+            reduced.append(c)
+    return reduced
+
+def bytes_reduce(polymer):
+    return reduce_units(encode_polymer(polymer)).decode('latin-1')
+
+def unit_groups(units):
+    """Bytes of each unit type in units, in order of first appearance"""
+    types = dict.fromkeys(UNIT_TYPES[c] for c in sorted(set(units), key=units.index))
+    return [UNIT_GROUPS[t] for t in types]
+
+def pick_shortest(reduced):
+    # Same choice as find_shorest_polymer, including an empty result not counting
+    shortest = b''
+    for candidate in reduced:
+        if not shortest or len(shortest) > len(candidate):
+            shortest = candidate
+    return shortest.decode('latin-1')
+
+def map_units(func, items, workers=1):
+    if workers == 1:
+        return list(map(func, items))
+    with Pool(workers) as pool:
+        return pool.map(func, items)
+
+def bytes_shortest_polymer(polymer, workers=1):
+    """find_shorest_polymer on encoded units
+
+    Each unit type is tried once, in order of first appearance, with a
+    process pool of workers when that is not 1.
+    """
+    units = encode_polymer(polymer)
+    return pick_shortest(map_units(partial(reduce_units, units), unit_groups(units), workers))
+
+def reduce_letters(units):
+    """reduce for units that are all ASCII letters, where the two
+    polarities of a type differ only in bit 5 (0x20)"""
+    reduced = bytearray()
+    for c in units:
+        if reduced and reduced[-1] ^ c == 32:
+            del reduced[-1]
+        else:
+            reduced.append(c)
+    return reduced
+
+def reduce_codes(units):
+    return reduce_letters(units) if units.isalpha() else reduce_units(units)
+
+def polymer_variants(units):
+    """units with each of its unit types deleted, in order of first appearance"""
+    return [units.translate(None, group) for group in unit_groups(units)]
+
+def translate_reduce(polymer):
+    return reduce_codes(encode_polymer(polymer)).decode('latin-1')
+
+def translate_shortest_polymer(polymer, workers=1):
+    """find_shorest_polymer with the unit types removed by bytes.translate
+    before reducing, instead of being skipped inside the reduction"""
+    variants = polymer_variants(encode_polymer(polymer))
+    return pick_shortest(map_units(reduce_codes, variants, workers))
+
+CHUNK_SIZE = 1 << 20
+
+def merge_reduced(left, right):
+    """Reduction of left + right for already reduced left (a bytearray,
+    extended in place) and right: only the units where they meet can react"""
+    partners = UNIT_PARTNERS
+    i = 0
+    while left and i < len(right) and left[-1] == partners[right[i]]:
+        del left[-1]
+        i += 1
+    left += memoryview(right)[i:]
+    return left
+
+def read_chunks(file_path, chunk_size=CHUNK_SIZE):
+    with open(file_path, 'rb') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def stream_reduce(file_path, chunk_size=CHUNK_SIZE, workers=1):
+    """Reduce a polymer file chunk by chunk
+
+    Reduction is a free group reduction, so chunks reduce independently and
+    the reduced chunks merge in order with merge_reduced. With a process
+    pool, chunks are handed out a batch at a time so only a few are held
+    in memory besides the reduced result.
+    """
+    chunks = read_chunks(file_path, chunk_size)
+    reduced = bytearray()
+    if workers == 1:
+        for chunk in chunks:
+            merge_reduced(reduced, reduce_codes(chunk))
+        return reduced
+
+    with Pool(workers) as pool:
+        batch_size = 2 * (workers or os.cpu_count() or 1)
+        while True:
+            batch = list(islice(chunks, batch_size))
+            if not batch:
+                return reduced
+            for part in pool.map(reduce_codes, batch):
+                merge_reduced(reduced, part)
+
+ENGINES = {
+    'string': (reduce, find_shorest_polymer),
+    'bytes': (bytes_reduce, bytes_shortest_polymer),
+    'translate': (translate_reduce, translate_shortest_polymer)
+}
 
 def main():
     """
@@ -51,15 +188,29 @@ def main():
     parser = argparse.ArgumentParser(description='Alchemical Reduction')
     parser.add_argument('-i', dest='file_path', help='path to input data file',
                         required=True)
+    parser.add_argument('-e', dest='engine', choices=ENGINES.keys(),
+                        default='translate', help='reduction engine')
+    parser.add_argument('-j', dest='workers', type=int, default=1,
+                        help='processes for the reductions (not the string engine)')
+    parser.add_argument('-s', dest='stream', action='store_true',
+                        help='reduce the file in chunks instead of reading it whole')
+    parser.add_argument('-c', dest='chunk_size', type=int, default=CHUNK_SIZE,
+                        help='bytes per chunk when streaming')
 
     args = parser.parse_args()
-    with open(args.file_path, 'r') as file:
-        input_data = file.read()
+    (reduce_polymer, shortest_polymer) = ENGINES[args.engine]
+    if args.engine != 'string':
+        shortest_polymer = partial(shortest_polymer, workers=args.workers)
 
-    reduced_polymer = reduce(input_data)
+    if args.stream:
+        reduced_polymer = stream_reduce(args.file_path, args.chunk_size, args.workers).decode('latin-1')
+    else:
+        with open(args.file_path, 'r') as file:
+            input_data = file.read()
+        reduced_polymer = reduce_polymer(input_data)
     print('Length of polymer: %s' % len(reduced_polymer))
 
-    shortest = find_shorest_polymer(reduced_polymer)
+    shortest = shortest_polymer(reduced_polymer)
     print('Length of shortest polymer: %s' % len(shortest))
 
 if __name__ == '__main__':
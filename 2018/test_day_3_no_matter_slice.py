@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+import random
+import unittest
+
+import day_3_no_matter_slice as slice_claims
+
+def claims_intersect(columns, a, b):
+    (x, y, w, h) = (columns.x, columns.y, columns.w, columns.h)
+    return (x[a] < x[b] + w[b] and x[b] < x[a] + w[a] and
+            y[a] < y[b] + h[b] and y[b] < y[a] + h[a])
+
+def count_entries(entry):
+    if not isinstance(entry[4], list):
+        return 1
+    return 1 + sum(count_entries(child) for child in entry[4])
+
+class ClaimIndexTest(unittest.TestCase):
+    def test_intersecting_matches_brute_force(self):
+        rand = random.Random(2)
+        for _ in range(300):
+            claims = ['#%d @ %d,%d: %dx%d' % (i + 1, rand.randint(0, 200), rand.randint(0, 200),
+                                              rand.choice([0, rand.randint(1, 40), rand.randint(1, 400)]),
+                                              rand.randint(0, 40))
+                      for i in range(rand.randint(0, 40))]
+            columns = slice_claims.claim_columns(claims)
+            index = slice_claims.ClaimIndex(columns, rand.randint(2, 8))
+            for row in range(len(columns)):
+                expected = [other for other in range(len(columns))
+                            if other != row and columns.w[row] and columns.h[row] and
+                            columns.w[other] and columns.h[other] and
+                            claims_intersect(columns, row, other)]
+                self.assertEqual(index.intersecting(row), expected)
+
+    def test_mixed_claim_sizes(self):
+        # One claim covering the whole fabric must not blow up the index
+        claims = ['#1 @ 0,0: 1000000x1000000']
+        claims += ['#%d @ %d,%d: 10x10' % (i + 2, (i * 7919) % 999990, (i * 104729) % 999990)
+                   for i in range(2000)]
+        claims.append('#2002 @ 1000000,0: 5x5')
+        columns = slice_claims.claim_columns(claims)
+        index = slice_claims.ClaimIndex(columns)
+
+        self.assertLess(count_entries(index.root), 2 * len(claims))
+        self.assertEqual(index.intersecting(0)[:3], [1, 2, 3])
+        self.assertEqual(len(index.intersecting(0)), 2000)
+        self.assertEqual(index.intersecting(2001), [])
+        self.assertEqual(slice_claims.indexed_non_overlap(columns).id, 2002)
+
+if __name__ == '__main__':
+    unittest.main()